@@ -1,10 +1,17 @@
 import asyncio
+import codecs
 import os
+import re
 import shlex
 from dataclasses import dataclass
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple
 
 DEFAULT_MAX_BYTES = 200_000
+READ_CHUNK_BYTES = 64 * 1024
+
+# CSI sequences (colors, cursor moves, erase line), OSC sequences (titles, links)
+# and the remaining two-byte escapes.
+_ANSI_RE = re.compile(r"\x1b(?:\[[0-?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)|[@-Z\\-_])")
 
 class CommandError(Exception):
     """Raised for command validation / execution issues not directly from the process exit code."""
@@ -16,6 +23,151 @@ class ExecResult:
     stderr: str
     truncated: bool
     timeout: bool
+    # Only set when output normalization ran (stdout + stderr combined)
+    raw_bytes: Optional[int] = None
+    compacted_bytes: Optional[int] = None
+
+class OutputNormalizer:
+    """Incrementally compact terminal output, in time linear in its size.
+
+    Strips ANSI escape codes, keeps only the final state of lines overwritten
+    with carriage returns (progress bars) and folds runs of identical lines into
+    one line plus a repeat count. At most ``max_bytes`` of compacted output is
+    kept; raw and compacted sizes are counted in full.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, encoding: str = "utf-8"):
+        self.max_bytes = max_bytes
+        self.encoding = encoding
+        self.raw_bytes = 0
+        self.compacted_bytes = 0
+        self.truncated = False
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._pending: List[str] = []
+        self._pending_len = 0
+        # Set when the current line was cut at max_bytes before its newline
+        self._pending_clipped = False
+        self._last: Optional[str] = None
+        self._repeats = 0
+        self._chunks: List[str] = []
+        self._kept = 0
+
+    def feed(self, data: bytes):
+        self.raw_bytes += len(data)
+        self._feed_text(self._decoder.decode(data))
+
+    def finish(self) -> str:
+        self._feed_text(self._decoder.decode(b"", final=True))
+        ends_with_newline = not self._pending
+        if not ends_with_newline:
+            self._emit_line(self._take())
+        self._flush_repeats()
+        out = "".join(self._chunks)
+        if not ends_with_newline and out.endswith("\n"):
+            out = out[:-1]
+        if self.truncated:
+            out += "\n...[TRUNCATED]..."
+        return out
+
+    def _feed_text(self, text: str):
+        parts = text.split("\n")
+        self._append(parts[0])
+        for part in parts[1:]:
+            self._emit_line(self._take())
+            self._append(part)
+
+    def _append(self, piece: str):
+        if not piece:
+            return
+        if self._pending and self._pending[-1].endswith("\r"):
+            # A lone carriage return: everything before it was overwritten
+            self._reset_pending()
+        # A trailing "\r" may be the first half of "\r\n", so keep it for now
+        cut = piece.rfind("\r", 0, len(piece) - 1)
+        if cut != -1:
+            self._reset_pending()
+            piece = piece[cut + 1 :]
+        # Bound memory for a line that never ends: keep at most max_bytes of it
+        # (plus a trailing "\r", still needed to recognise "\r\n")
+        room = self.max_bytes - self._pending_len
+        if len(piece) > room:
+            self._pending_clipped = True
+            piece = piece[: max(room, 0)] + ("\r" if piece.endswith("\r") else "")
+            if not piece:
+                return
+        self._pending.append(piece)
+        self._pending_len += len(piece)
+
+    def _reset_pending(self):
+        self._pending = []
+        self._pending_len = 0
+        self._pending_clipped = False
+
+    def _take(self) -> str:
+        line = "".join(self._pending)
+        if self._pending_clipped:
+            self.truncated = True
+        self._reset_pending()
+        if line.endswith("\r"):
+            line = line[:-1]
+        return _ANSI_RE.sub("", line)
+
+    def _emit_line(self, line: str):
+        if line == self._last:
+            self._repeats += 1
+            return
+        self._flush_repeats()
+        self._write(line + "\n")
+        self._last = line
+
+    def _flush_repeats(self):
+        if not self._repeats:
+            return
+        times = "time" if self._repeats == 1 else "times"
+        marker = f"[previous line repeated {self._repeats} more {times}]\n"
+        repeated = (self._last + "\n") * self._repeats
+        # Only fold when it actually saves space (never for a couple of short lines)
+        if len(repeated.encode(self.encoding)) > len(marker.encode(self.encoding)):
+            self._write(marker)
+        else:
+            self._write(repeated)
+        self._repeats = 0
+
+    def _write(self, text: str):
+        data = text.encode(self.encoding)
+        self.compacted_bytes += len(data)
+        room = self.max_bytes - self._kept
+        if len(data) > room:
+            self.truncated = True
+            data = data[: max(room, 0)]
+            text = data.decode(self.encoding, errors="ignore")
+        if data:
+            self._chunks.append(text)
+            self._kept += len(data)
+
+def normalize_output(data: bytes, max_bytes: int = DEFAULT_MAX_BYTES, encoding: str = "utf-8") -> str:
+    """One-shot helper around OutputNormalizer."""
+    normalizer = OutputNormalizer(max_bytes=max_bytes, encoding=encoding)
+    normalizer.feed(data)
+    return normalizer.finish()
+
+async def _pump(stream: asyncio.StreamReader, normalizer: OutputNormalizer):
+    while True:
+        chunk = await stream.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        normalizer.feed(chunk)
+
+async def _write_stdin(proc: asyncio.subprocess.Process, data: Optional[bytes]):
+    if data is None:
+        return
+    try:
+        proc.stdin.write(data)
+        await proc.stdin.drain()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        proc.stdin.close()
 
 async def run_subprocess(
     command: str,
@@ -27,9 +179,13 @@ async def run_subprocess(
     env: Optional[Dict[str, str]] = None,
     encoding: str = "utf-8",
     max_output_bytes: int = DEFAULT_MAX_BYTES,
+    normalize: bool = False,
 ) -> ExecResult:
     """Execute a command robustly.
 
+    With ``normalize`` the output is streamed through OutputNormalizer as it
+    is produced, and ``max_output_bytes`` applies to the compacted output.
+
     Returns ExecResult. Raises CommandError for validation or timeout.
     """
     if not command or not command.strip():
@@ -69,6 +225,8 @@ async def run_subprocess(
     proc = await create
 
     send_input = stdin.encode(encoding) if stdin else None
+    if normalize:
+        return await _run_normalized(proc, send_input, timeout, encoding, max_output_bytes)
     try:
         stdout_b, stderr_b = await asyncio.wait_for(proc.communicate(send_input), timeout=timeout)
         timed_out = False
@@ -94,3 +252,41 @@ async def run_subprocess(
     stderr = stderr_b.decode(encoding, errors="replace")
 
     return ExecResult(code=proc.returncode, stdout=stdout, stderr=stderr, truncated=truncated, timeout=timed_out)
+
+async def _run_normalized(
+    proc: asyncio.subprocess.Process,
+    send_input: Optional[bytes],
+    timeout: Optional[float],
+    encoding: str,
+    max_output_bytes: int,
+) -> ExecResult:
+    out = OutputNormalizer(max_bytes=max_output_bytes, encoding=encoding)
+    err = OutputNormalizer(max_bytes=max_output_bytes, encoding=encoding)
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(
+                _write_stdin(proc, send_input),
+                _pump(proc.stdout, out),
+                _pump(proc.stderr, err),
+                proc.wait(),
+            ),
+            timeout=timeout,
+        )
+    except asyncio.TimeoutError:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        raise CommandError(f"Timeout after {timeout}s")
+
+    stdout = out.finish()
+    stderr = err.finish()
+    return ExecResult(
+        code=proc.returncode,
+        stdout=stdout,
+        stderr=stderr,
+        truncated=out.truncated or err.truncated,
+        timeout=False,
+        raw_bytes=out.raw_bytes + err.raw_bytes,
+        compacted_bytes=out.compacted_bytes + err.compacted_bytes,
+    )
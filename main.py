@@ -3,6 +3,17 @@ from fastmcp import FastMCP
 from command_exec import run_subprocess, CommandError
 from datetime import datetime
 from utils.init_sandbox import ensure_sandbox_exists
+from utils.placement import placement, SANDBOX_NAME
+from utils import workspace_sync
+from utils.workspace_state import (
+    bump_generation,
+    etag_matches,
+    file_etag,
+    listing_etag,
+    mark_dirty,
+    not_modified,
+    workspace_generation,
+)
 from shlex import quote
 import os
 
@@ -16,6 +27,8 @@ load_dotenv()
 # Use base64 to avoid shell escaping issues
 import base64
 
+# Content guard for read_file
+MAX_READ_BYTES = 500_000
 
 mcp = FastMCP(
     name="Sandbox MCP",
@@ -84,50 +97,49 @@ Usage example (tool call payload):
 
 ## read_file
 
-Description: Return the full textual content of a file within the project root (UTF-8). Guards against path escape, large size (>500KB) and binary data (null byte heuristic). Returns content plus size and timestamp.
+Description: Return the textual content of a file in the sandbox (UTF-8). Guards against large size (>500KB, the content is truncated) and binary data (null byte heuristic). Returns content plus truncation flag, etag and timestamp.
 
 Parameters:
 
-- `path` (string, required): File path (relative to root or absolute). `~` expanded. Must resolve inside project root.
+- `path` (string, required): File path. Relative paths are resolved against `/workspace`; absolute paths are used as is.
+- `if_none_match` (string, optional): `etag` from a previous read of the same file.
 
 Return shape:
 
-- `path`: absolute resolved path
+- `path`: absolute path inside the sandbox
 - `content`: file text (may include a trailing TRUNCATED marker if size guard triggered)
 - `truncated`: boolean
+- `etag`: content hash of the bytes served; pass it back as `if_none_match` on the next read
+- `not_modified`: true (with `etag` and `path` only, no `content`) when `if_none_match` still matches
+- `timestamp`: ISO8601 UTC
+- `is_error` / `message`: on failure
 
-## list_file
+## list_files
 
-Description: List (non-recursive) directory entries at a given path inside project root. Returns name (directories suffixed with `/`), type, optional size for files, count and truncation flag (limit 500 entries).
+Description: List the top level of `/workspace` (non-recursive `ls -la`).
 
 Parameters:
 
-- `path` (string, optional, default "."): Directory path to enumerate.
+- `if_none_match` (string, optional): `etag` from a previous listing.
 
 Return shape:
 
-- `path`: absolute directory path
-- `entries`: array of { name, type (file|directory), size? }
-- `truncated`: boolean (true if limit reached)
-- `count`: number of returned entries
-- `timestamp`: ISO8601 UTC
+- `segments`: array of { name ("STDOUT"|"STDERR"), text } holding the `ls -la` output
+- `exit_code`, `truncated`, `timeout`, `command`: details of the listing command
+- `generation`: workspace generation counter
+- `etag`: listing tag; it changes whenever a top-level entry of `/workspace` is added, removed or modified, including by commands or background processes
+- `not_modified`: true (with `etag` only, no `segments`) when `if_none_match` still matches
 - `is_error` / `message`: on failure
 
 Example tool call:
-<list_file>
-<path>src/</path>
-</list_file>
+<list_files>
+<if_none_match>"3f2a9c1e-7"</if_none_match>
+</list_files>
 
-Example response (conceptual):
+Example response when nothing changed:
 {
-"path": "/workspace/src",
-"entries": [
-{ "name": "utils/", "type": "directory" },
-{ "name": "main.py", "type": "file", "size": 2048 }
-],
-"truncated": false,
-"count": 2,
-"timestamp": "2025-09-13T12:34:56Z"
+"not_modified": true,
+"etag": "\\"3f2a9c1e-7\\""
 }
 
 ## push_files
@@ -150,6 +162,26 @@ Return shape:
 - `stdout`: Output from the deployment process.
 - `is_error` / `message` / `stderr` / `exit_code`: present on failure.
 
+## sync_to_host / sync_from_host
+
+Description: Mirror `/workspace` into a directory on the MCP host (`sync_to_host`) or a host directory into `/workspace` (`sync_from_host`). Only changed blocks of changed files are transferred (rsync-style rolling checksums), and files unchanged since the previous sync are skipped without being read. Permissions, modification times and (empty) directories are preserved; symlinks are skipped.
+
+Parameters:
+
+- `host_dir` (required, string): Directory on the host, relative to `SANDBOX_SYNC_ROOT`.
+- `include` (optional, array of strings): Glob patterns; only matching files are synced.
+- `exclude` (optional, array of strings): Glob patterns for files or directories to skip (e.g. `node_modules`).
+- `delete` (optional, boolean): Remove destination files that no longer exist at the source.
+
+Return shape:
+
+- `host_dir`: absolute host directory
+- `method`: `rsync` when rsync is available on both sides, otherwise `delta` (built-in transfer)
+- `files_scanned`, `files_checked`, `files_updated`, `files_deleted`
+- `bytes_total`, `bytes_synced`, `bytes_literal` (sent as data), `bytes_matched` (reused from the destination), `wire_bytes`
+- `elapsed_s`, `throughput_bytes_per_s`
+- `is_error` / `message`: present on failure.
+
 ## get_workspace_public_url
 Description: Start http.server + ngrok inside the sandbox container and return the public URL. This tool allow you to expose the /workspace directory over the internet for easy file access and serving.
 
@@ -176,11 +208,14 @@ Return shape:
 )
 async def get_workspace_public_url(port: int = 8000) -> dict:
     print("port", port)
-    await ensure_sandbox_exists()
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    docker = placement.docker()
 
     # start http.server (serves /workspace)
     await run_subprocess(
-        "docker exec -d sandbox python -m http.server 8000", shell=True
+        f"{docker} exec -d {SANDBOX_NAME} python -m http.server 8000", shell=True
     )
 
     # start ngrok using auth token from environment
@@ -189,12 +224,12 @@ async def get_workspace_public_url(port: int = 8000) -> dict:
         return {"is_error": True, "message": "Missing NGROK_AUTHTOKEN in environment"}
 
     await run_subprocess(
-        f"docker exec -d sandbox ngrok http {port} --authtoken {ngrok_token} --log=stdout",
+        f"{docker} exec -d {SANDBOX_NAME} ngrok http {port} --authtoken {ngrok_token} --log=stdout",
         shell=True,
     )
 
     # fetch public URL via ngrok's local API *inside* the container
-    cmd = "docker exec sandbox sh -c 'curl -s http://127.0.0.1:4040/api/tunnels | jq -r \".tunnels[0].public_url\"'"
+    cmd = f"{docker} exec {SANDBOX_NAME} sh -c 'curl -s http://127.0.0.1:4040/api/tunnels | jq -r \".tunnels[0].public_url\"'"
     result = await run_subprocess(cmd, shell=True)
 
     if (
@@ -211,12 +246,19 @@ async def get_workspace_public_url(port: int = 8000) -> dict:
 
 @mcp.tool(
     title="List files in the sandbox",
-    description="List the files in the sandbox workspace directory",
+    description="List the files in the sandbox workspace directory. Pass the etag of a previous listing as if_none_match to get a tiny not_modified response when nothing changed.",
 )
-async def list_files() -> dict:
-    await ensure_sandbox_exists()
+async def list_files(if_none_match: Optional[str] = None) -> dict:
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    docker = placement.docker()
+
+    etag, matches = await listing_etag(if_none_match)
+    if matches:
+        return not_modified(etag)
 
-    command = "docker exec sandbox ls /workspace -la"
+    command = f"{docker} exec {SANDBOX_NAME} ls /workspace -la"
 
     try:
         result = await run_subprocess(
@@ -233,10 +275,13 @@ async def list_files() -> dict:
             "truncated": result.truncated,
             "timeout": result.timeout,
             "command": command,
+            "generation": workspace_generation(),
         }
         is_error = result.code != 0
         if is_error:
             meta["is_error"] = True
+        else:
+            meta["etag"] = etag
         return {"segments": segments, **meta}
     except CommandError as ce:
         return {
@@ -246,10 +291,61 @@ async def list_files() -> dict:
         }
 
 
+@mcp.tool(
+    title="Read File",
+    description="Read a text file from the sandbox workspace. Pass the etag of a previous read as if_none_match to get a tiny not_modified response when the content is unchanged.",
+)
+async def read_file(path: str, if_none_match: Optional[str] = None) -> dict:
+    """Return the content of a file along with a content-hash ETag.
+
+    The hash of the bytes a read would serve is computed inside the container
+    first, so an unchanged file costs one short round-trip and no content
+    transfer.
+    """
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    docker = placement.docker()
+
+    container_path = path
+    if not os.path.isabs(container_path):
+        container_path = f"/workspace/{container_path}"
+
+    try:
+        etag = await file_etag(container_path, MAX_READ_BYTES + 1)
+    except CommandError as ce:
+        return {"is_error": True, "message": str(ce), "path": path}
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, path=container_path)
+
+    read_cmd = f"{docker} exec {SANDBOX_NAME} sh -c {quote(f'head -c {MAX_READ_BYTES + 1} {quote(container_path)} | base64')}"
+    read_result = await run_subprocess(read_cmd, shell=True, max_output_bytes=MAX_READ_BYTES * 2)
+    if read_result.code != 0:
+        return {
+            "is_error": True,
+            "message": f"Failed to read file: {read_result.stderr or 'Unknown error'}",
+            "path": path,
+        }
+    raw = base64.b64decode(read_result.stdout.encode("utf-8"))
+    if b"\x00" in raw:
+        return {"is_error": True, "message": "Binary file", "path": path}
+    truncated = len(raw) > MAX_READ_BYTES
+    content = raw[:MAX_READ_BYTES].decode("utf-8", errors="replace")
+    if truncated:
+        content += "\n...[TRUNCATED]..."
+    return {
+        "path": container_path,
+        "content": content,
+        "truncated": truncated,
+        "etag": etag,
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+    }
+
+
 @mcp.tool(
     name="run_command",
     title="Run Command in the Sandbox",
-    description="Execute a command inside the sandbox container. Supports stdin, timeout and output truncation.",
+    description="Execute a command inside the sandbox container. Supports stdin, timeout and output truncation. Set normalize_output to strip ANSI colors, collapse progress bars and fold repeated lines.",
 )
 async def run_command(
     command: str,
@@ -257,16 +353,21 @@ async def run_command(
     timeout: Optional[float] = None,
     shell: bool = True,
     max_output_bytes: int = 200_000,
+    normalize_output: bool = False,
 ) -> dict:
     """Execute a command inside the sandbox container and return structured segments.
 
     Returns a dict with segments list: each segment has name and text.
     Errors return is_error True and may omit stdout if not produced.
+    With normalize_output, raw_bytes and compacted_bytes report the saving.
     """
-    await ensure_sandbox_exists()
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    docker = placement.docker()
 
     # Use stdin to pipe the script into the container for robust multi-line support
-    docker_command = "docker exec -i sandbox sh"
+    docker_command = f"{docker} exec -i {SANDBOX_NAME} sh"
 
     try:
         # If stdin is provided, prepend the command to it; otherwise, use command as stdin
@@ -277,13 +378,16 @@ async def run_command(
             timeout=timeout,
             shell=shell,
             max_output_bytes=max_output_bytes,
+            normalize=normalize_output,
         )
     except CommandError as ce:
+        mark_dirty()
         return {
             "is_error": True,
             "message": str(ce),
             "command": command,
         }
+    mark_dirty()
     segments = []
     if result.stdout:
         segments.append({"name": "STDOUT", "text": result.stdout})
@@ -295,6 +399,9 @@ async def run_command(
         "timeout": result.timeout,
         "command": command,
     }
+    if normalize_output:
+        meta["raw_bytes"] = result.raw_bytes
+        meta["compacted_bytes"] = result.compacted_bytes
     is_error = result.code != 0
     if is_error:
         meta["is_error"] = True
@@ -317,7 +424,10 @@ async def write_to_file(path: str, content: str) -> dict:
         path="~/output.txt",
         content="Full file content here"
     """
-    await ensure_sandbox_exists()
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    docker = placement.docker()
 
     # Normalize potential accidental code fences
     if content.startswith("```") and content.endswith("```"):
@@ -340,10 +450,11 @@ async def write_to_file(path: str, content: str) -> dict:
     encoded = base64.b64encode(content.encode("utf-8")).decode("ascii")
     write_cmd = f"echo '{encoded}' | base64 -d > {quote(container_path)}"
     full_cmd = f"{mkdir_cmd} && {write_cmd}"
-    docker_cmd = f"docker exec sandbox sh -c {quote(full_cmd)}"
+    docker_cmd = f"{docker} exec {SANDBOX_NAME} sh -c {quote(full_cmd)}"
 
     try:
         result = await run_subprocess(docker_cmd, shell=True)
+        bump_generation()
         if result.code != 0:
             return {
                 "is_error": True,
@@ -351,7 +462,7 @@ async def write_to_file(path: str, content: str) -> dict:
                 "path": path,
             }
         # Get file size inside container
-        stat_cmd = f"docker exec sandbox sh -c 'stat -c %s {quote(container_path)}'"
+        stat_cmd = f"{docker} exec {SANDBOX_NAME} sh -c 'stat -c %s {quote(container_path)}'"
         stat_result = await run_subprocess(stat_cmd, shell=True)
         if stat_result.code == 0 and stat_result.stdout:
             bytes_written = int(stat_result.stdout.strip())
@@ -388,20 +499,23 @@ async def replace_in_file(path: str, replacements: list[dict]) -> dict:
             {"search": "another_old", "replace": "another_new"},
         ]
     """
-    await ensure_sandbox_exists()
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    docker = placement.docker()
 
     container_path = path
     if not os.path.isabs(container_path):
         container_path = f"/workspace/{container_path}"
 
     # Check if file exists in container
-    check_cmd = f"docker exec sandbox sh -c 'test -f {quote(container_path)}'"
+    check_cmd = f"{docker} exec {SANDBOX_NAME} sh -c 'test -f {quote(container_path)}'"
     check_result = await run_subprocess(check_cmd, shell=True)
     if check_result.code != 0:
         return {"is_error": True, "message": "File does not exist", "path": path}
 
     # Read file content from container (base64 to avoid encoding issues)
-    read_cmd = f"docker exec sandbox sh -c 'base64 {quote(container_path)}'"
+    read_cmd = f"{docker} exec {SANDBOX_NAME} sh -c 'base64 {quote(container_path)}'"
     read_result = await run_subprocess(read_cmd, shell=True)
     if read_result.code != 0 or not read_result.stdout:
         return {
@@ -440,8 +554,9 @@ async def replace_in_file(path: str, replacements: list[dict]) -> dict:
         # Write back to file in container using base64
         encoded = base64.b64encode(modified.encode("utf-8")).decode("ascii")
         write_cmd = f"echo '{encoded}' | base64 -d > {quote(container_path)}"
-        docker_cmd = f"docker exec sandbox sh -c {quote(write_cmd)}"
+        docker_cmd = f"{docker} exec {SANDBOX_NAME} sh -c {quote(write_cmd)}"
         write_result = await run_subprocess(docker_cmd, shell=True)
+        bump_generation()
         if write_result.code != 0:
             return {
                 "is_error": True,
@@ -457,12 +572,67 @@ async def replace_in_file(path: str, replacements: list[dict]) -> dict:
     }
 
 
+@mcp.tool(
+    title="Sync Workspace to Host",
+    description="Copy /workspace to a directory on the MCP host, transferring only changed blocks of changed files (rsync-style). Supports include/exclude glob filters and optional deletion of files missing from the workspace.",
+)
+async def sync_to_host(
+    host_dir: str,
+    include: Optional[list[str]] = None,
+    exclude: Optional[list[str]] = None,
+    delete: bool = False,
+) -> dict:
+    """Incrementally mirror /workspace into host_dir (relative to SANDBOX_SYNC_ROOT).
+
+    Returns throughput stats: files scanned/updated/deleted, literal vs matched
+    bytes, wire bytes and elapsed time.
+    """
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    try:
+        stats = await workspace_sync.sync_to_host(host_dir, include, exclude, delete)
+    except (workspace_sync.SyncError, CommandError, OSError, ValueError) as e:
+        return {"is_error": True, "message": str(e), "host_dir": host_dir}
+    return {**stats, "timestamp": datetime.utcnow().isoformat() + "Z"}
+
+
+@mcp.tool(
+    title="Sync Workspace from Host",
+    description="Copy a directory on the MCP host into /workspace, transferring only changed blocks of changed files (rsync-style). Supports include/exclude glob filters and optional deletion of files missing on the host.",
+)
+async def sync_from_host(
+    host_dir: str,
+    include: Optional[list[str]] = None,
+    exclude: Optional[list[str]] = None,
+    delete: bool = False,
+) -> dict:
+    """Incrementally mirror host_dir (relative to SANDBOX_SYNC_ROOT) into /workspace.
+
+    Returns the same stats as sync_to_host.
+    """
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    try:
+        stats = await workspace_sync.sync_from_host(host_dir, include, exclude, delete)
+    except (workspace_sync.SyncError, CommandError, OSError, ValueError) as e:
+        bump_generation()
+        return {"is_error": True, "message": str(e), "host_dir": host_dir}
+    if stats["files_updated"] or stats["files_deleted"]:
+        bump_generation()
+    return {**stats, "timestamp": datetime.utcnow().isoformat() + "Z"}
+
+
 @mcp.tool(
     title="Push Files to GitHub",
     description="Push files in the sandbox to Github, creating a new repository first.",
 )
 async def push_files(repo_name: str = "default_name") -> dict:
-    await ensure_sandbox_exists()
+    error = await ensure_sandbox_exists()
+    if error:
+        return error
+    docker = placement.docker()
 
     # 1. Get repo name (use timestamp for uniqueness)
     repo_name = f"sandbox-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
@@ -498,10 +668,11 @@ async def push_files(repo_name: str = "default_name") -> dict:
     # d. If gh CLI fails to push, try manual push
     cmds.append("git push origin main")
 
-    # 5. Run each command, collect output
+    # 5. Run each command, collect output (git init/commit touch /workspace/.git)
+    bump_generation()
     results = []
     for cmd in cmds:
-        docker_cmd = f"docker exec -e GH_TOKEN='{gh_token}' sandbox sh -c {quote(cmd)}"
+        docker_cmd = f"{docker} exec -e GH_TOKEN='{gh_token}' {SANDBOX_NAME} sh -c {quote(cmd)}"
         try:
             res = await run_subprocess(docker_cmd, shell=True)
             results.append(
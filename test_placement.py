@@ -0,0 +1,137 @@
+import asyncio
+import os
+import tempfile
+import time
+from command_exec import CommandError, ExecResult
+from utils import placement as placement_module
+from utils.placement import SandboxPlacement, HostLoad, PlacementError, docker_cli, find_container
+
+# Fake endpoints: url -> (containers, cpu, memory); None means unreachable
+LOADS = {
+    "tcp://a:2375": (10, 0.5, 0.5),
+    "tcp://b:2375": (2, 0.1, 0.2),
+    "tcp://c:2375": None,
+}
+
+async def fake_probe(url):
+    if LOADS[url] is None:
+        raise CommandError(f"cannot connect to {url}")
+    return HostLoad(url, *LOADS[url])
+
+def make_locator(existing, unreachable=()):
+    async def locate(url, name):
+        if url in unreachable:
+            raise CommandError(f"cannot connect to {url}")
+        return (url, name) in existing
+    return locate
+
+def make_placement(drained=None, existing=()):
+    return SandboxPlacement(
+        list(LOADS), drained=drained, prober=fake_probe, locator=make_locator(set(existing))
+    )
+
+async def test_least_loaded():
+    p = make_placement()
+    assert await p.place("sandbox") == "tcp://b:2375"
+    assert p.docker("sandbox") == "docker -H tcp://b:2375"
+
+async def test_drain():
+    p = make_placement(drained=["tcp://b:2375"])
+    assert await p.place("sandbox") == "tcp://a:2375"
+    with tempfile.TemporaryDirectory() as tmp:
+        # Draining at runtime through the drain file, re-read on every placement
+        p.drain_file = os.path.join(tmp, "drained")
+        with open(p.drain_file, "w") as f:
+            f.write("tcp://a:2375\n")
+        try:
+            await p.place("other")
+        except PlacementError:
+            pass
+        else:
+            raise AssertionError("Expected PlacementError")
+        p.drained.clear()
+        assert await p.place("other") == "tcp://b:2375"
+        os.unlink(p.drain_file)
+        assert await p.place("third") == "tcp://b:2375"
+        # Existing sandboxes keep routing to a drained host
+        assert p.docker("sandbox") == "docker -H tcp://a:2375"
+
+async def test_locate_existing():
+    p = make_placement(existing=[("tcp://a:2375", "sandbox")])
+    assert await p.locate("sandbox") == "tcp://a:2375"
+    try:
+        await p.locate("missing")
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("Expected KeyError")
+
+async def test_locate_forgets_removed():
+    p = make_placement()
+    await p.place("sandbox")
+    try:
+        await p.locate("sandbox")
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("Expected KeyError")
+    assert "sandbox" not in p.placements
+
+async def test_locate_unreachable_host():
+    p = make_placement(existing=[("tcp://a:2375", "sandbox")])
+    assert await p.locate("sandbox") == "tcp://a:2375"
+    # A blip on the recorded host is an error, not a reason to recreate elsewhere
+    p.locator = make_locator({("tcp://a:2375", "sandbox")}, unreachable={"tcp://a:2375"})
+    try:
+        await p.locate("sandbox")
+    except PlacementError:
+        pass
+    else:
+        raise AssertionError("Expected PlacementError")
+    assert p.placements["sandbox"] == "tcp://a:2375"
+    # Unreachable hosts are skipped when scanning for an unknown sandbox
+    p.locator = make_locator({("tcp://b:2375", "other")}, unreachable={"tcp://c:2375"})
+    assert await p.locate("other") == "tcp://b:2375"
+
+async def test_find_container_raises():
+    async def failing(command, **kwargs):
+        return ExecResult(code=1, stdout="", stderr="Cannot connect to the Docker daemon", truncated=False, timeout=False)
+    original = placement_module.run_subprocess
+    placement_module.run_subprocess = failing
+    try:
+        await find_container("tcp://a:2375", "sandbox")
+    except CommandError as ce:
+        assert "Cannot connect" in str(ce)
+    else:
+        raise AssertionError("Expected CommandError")
+    finally:
+        placement_module.run_subprocess = original
+
+async def test_probes_concurrently():
+    async def slow_probe(url):
+        await asyncio.sleep(0.2)
+        return await fake_probe(url)
+    p = make_placement()
+    p.prober = slow_probe
+    start = time.monotonic()
+    assert await p.place("sandbox") == "tcp://b:2375"
+    assert time.monotonic() - start < 0.4
+
+def test_default_host():
+    p = SandboxPlacement([])
+    assert p.docker() == "docker"
+    assert docker_cli(None) == "docker"
+
+async def main():
+    await test_least_loaded()
+    await test_drain()
+    await test_locate_existing()
+    await test_locate_forgets_removed()
+    await test_locate_unreachable_host()
+    await test_find_container_raises()
+    await test_probes_concurrently()
+    test_default_host()
+    print("All tests passed")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,5 @@
 import asyncio
-from command_exec import run_subprocess, CommandError
+from command_exec import run_subprocess, CommandError, OutputNormalizer, normalize_output
 import os
 
 async def test_success():
@@ -24,11 +24,45 @@ async def test_timeout():
     else:
         raise AssertionError("Expected timeout")
 
+def test_normalize_output():
+    raw = b"\x1b[31mred\x1b[0m\r\n 10%\r 50%\r100%\n" + b"x\n" * 30 + b"done"
+    assert normalize_output(raw) == "red\n100%\nx\n[previous line repeated 29 more times]\ndone"
+
+def test_normalize_long_line():
+    # A line with no newline must not grow past max_bytes, even when fed in pieces
+    normalizer = OutputNormalizer(max_bytes=100)
+    for _ in range(1000):
+        normalizer.feed(b"x" * 1000)
+    assert normalizer._pending_len <= 100
+    out = normalizer.finish()
+    assert normalizer.truncated and out.startswith("x" * 100)
+    # A progress bar overwritten by "\r" is not truncated: only its last state counts
+    normalizer = OutputNormalizer(max_bytes=100)
+    normalizer.feed(b"y" * 1000 + b"\rdone\n")
+    assert normalizer.finish() == "done\n" and not normalizer.truncated
+    line = "W" * 60
+    assert normalize_output(f"{line}\n{line}\n".encode()) == f"{line}\n[previous line repeated 1 more time]\n"
+
+def test_normalize_short_repeats():
+    # Folding is skipped when the marker would be longer than the lines it replaces
+    assert normalize_output(b"a\na\n") == "a\na\n"
+    assert normalize_output(b"x\n\n\n\ny\n") == "x\n\n\n\ny\n"
+
+async def test_normalize():
+    res = await run_subprocess("printf '1\\r2\\r3\\n'; yes hi | head -100", normalize=True)
+    assert res.stdout == "3\nhi\n[previous line repeated 99 more times]\n"
+    assert res.raw_bytes == 306
+    assert res.compacted_bytes == len(res.stdout)
+
 async def main():
     await test_success()
     await test_stdin()
     await test_workdir()
     await test_timeout()
+    test_normalize_output()
+    test_normalize_long_line()
+    test_normalize_short_repeats()
+    await test_normalize()
     print("All tests passed")
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+import asyncio
+from command_exec import ExecResult
+from utils import workspace_state
+from utils.workspace_state import (
+    bump_generation,
+    etag_matches,
+    not_modified,
+    workspace_etag,
+)
+
+def test_bump_changes_etag():
+    before = workspace_etag()
+    bump_generation()
+    assert workspace_etag() != before
+
+def test_etag_matches():
+    etag = workspace_etag()
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"stale"', etag)
+
+def test_not_modified():
+    res = not_modified('"abc"', path="/workspace/a.txt")
+    assert res == {"not_modified": True, "etag": '"abc"', "path": "/workspace/a.txt"}
+
+class FakeSandbox:
+    """Stands in for run_subprocess: answers fingerprint and sha256sum commands."""
+
+    def __init__(self):
+        self.fingerprint = "aaa"
+        self.digest = "111"
+        self.fail = False
+        self.commands = []
+
+    async def __call__(self, command, **kwargs):
+        self.commands.append(command)
+        if self.fail:
+            return ExecResult(code=1, stdout="", stderr="find failed", truncated=False, timeout=False)
+        if "sha256sum" in command:
+            return ExecResult(code=0, stdout=f"{self.digest}  /workspace/a.txt\n", stderr="", truncated=False, timeout=False)
+        return ExecResult(code=0, stdout=f"{self.fingerprint}  -\n", stderr="", truncated=False, timeout=False)
+
+async def with_fake_sandbox(test):
+    fake = FakeSandbox()
+    original = workspace_state.run_subprocess
+    workspace_state.run_subprocess = fake
+    # Start each test from an unknown workspace
+    workspace_state.sandbox_created()
+    try:
+        await test(fake)
+    finally:
+        workspace_state.run_subprocess = original
+
+async def test_listing_not_modified(fake):
+    etag, matches = await workspace_state.listing_etag()
+    assert not matches
+    # Unconditional listings of a clean workspace do not fingerprint again
+    fake.commands.clear()
+    assert await workspace_state.listing_etag() == (etag, False)
+    assert fake.commands == []
+    # Conditional listings always re-check, so background writes are seen
+    assert await workspace_state.listing_etag(etag) == (etag, True)
+    assert len(fake.commands) == 1
+    fake.fingerprint = "bbb"
+    new_etag, matches = await workspace_state.listing_etag(etag)
+    assert new_etag != etag and not matches
+
+async def test_command_marks_dirty(fake):
+    etag, _ = await workspace_state.listing_etag()
+    workspace_state.mark_dirty()
+    fake.commands.clear()
+    assert await workspace_state.listing_etag() == (etag, False)
+    assert len(fake.commands) == 1
+
+async def test_sandbox_created(fake):
+    etag, _ = await workspace_state.listing_etag()
+    workspace_state.sandbox_created()
+    # Same fingerprint, but the sandbox is new: the old ETag must not match
+    assert not (await workspace_state.listing_etag(etag))[1]
+
+async def test_fingerprint_failure(fake):
+    etag, _ = await workspace_state.listing_etag()
+    fake.fail = True
+    new_etag, matches = await workspace_state.listing_etag(etag)
+    assert new_etag != etag and not matches
+
+async def test_listing_fingerprint_is_shallow(fake):
+    await workspace_state.listing_etag()
+    # Only the listed level is walked, not the whole tree
+    assert "-maxdepth 1" in fake.commands[-1]
+
+async def test_file_etag(fake):
+    etag = await workspace_state.file_etag("/workspace/a.txt", 1000)
+    assert etag == '"sha256:111"'
+    # Only the bytes a read can serve are hashed
+    assert "head -c 1000" in fake.commands[-1]
+    fake.digest = "222"
+    assert await workspace_state.file_etag("/workspace/a.txt", 1000) != etag
+
+async def main():
+    test_bump_changes_etag()
+    test_etag_matches()
+    test_not_modified()
+    await with_fake_sandbox(test_listing_not_modified)
+    await with_fake_sandbox(test_command_marks_dirty)
+    await with_fake_sandbox(test_sandbox_created)
+    await with_fake_sandbox(test_fingerprint_failure)
+    await with_fake_sandbox(test_listing_fingerprint_is_shallow)
+    await with_fake_sandbox(test_file_etag)
+    print("All tests passed")
+
+if __name__ == "__main__":
+    asyncio.run(main())
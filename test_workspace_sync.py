@@ -0,0 +1,210 @@
+import asyncio
+import os
+import stat
+import tempfile
+from utils import rsync_delta, workspace_sync
+from utils.placement import placement
+
+def roundtrip(old: bytes, new: bytes):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "f")
+        with open(path, "wb") as f:
+            f.write(old)
+        with open(os.path.join(tmp, "new"), "wb") as f:
+            f.write(new)
+        ops = rsync_delta.delta(new, rsync_delta.signature(path))
+        rsync_delta.patch(path, ops, path, rsync_delta.file_digest(os.path.join(tmp, "new")))
+        with open(path, "rb") as f:
+            assert f.read() == new
+        return ops
+
+def counted(ops):
+    transfer = workspace_sync._Transfer()
+    for op in ops:
+        transfer.count(op)
+    return transfer
+
+def test_delta_roundtrip():
+    base = os.urandom(200_000)
+    ops = roundtrip(base, base[:5000] + b"inserted" + base[5000:] + b"tail")
+    transfer = counted(ops)
+    assert transfer.literal < 10_000
+    assert transfer.matched + transfer.literal == len(base) + len(b"inserted") + len(b"tail")
+    assert roundtrip(base, base) == [["c", 0, len(base)]]
+    roundtrip(b"", b"new file")
+    roundtrip(base, b"")
+
+def test_literal_chunks():
+    # A rewritten file streams as bounded literal ops, never one op per file
+    new = os.urandom(3 * rsync_delta.LITERAL_CHUNK + 123)
+    ops = roundtrip(os.urandom(100_000), new)
+    assert len(ops) >= 4
+    assert all(op[0] == "l" and len(op[1]) <= rsync_delta.LITERAL_CHUNK * 4 // 3 + 4 for op in ops)
+    assert counted(ops).literal == len(new)
+
+def test_manifest_filters():
+    with tempfile.TemporaryDirectory() as tmp:
+        for rel in ["a.csv", "b.txt", "node_modules/x.csv", "data/c.csv"]:
+            os.makedirs(os.path.dirname(os.path.join(tmp, rel)), exist_ok=True)
+            open(os.path.join(tmp, rel), "w").close()
+        files = rsync_delta.manifest(tmp, include=["*.csv"], exclude=["node_modules"])
+        assert sorted(files) == ["a.csv", "data/c.csv"]
+
+def test_rsync_args_and_stats():
+    args = workspace_sync._rsync_args("sandbox:/workspace/", "/host/", ["*.csv"], ["node_modules"], True)
+    assert args[:2] == ["rsync", "-rtp"] and "--delete" in args
+    assert args.index("--exclude=node_modules") < args.index("--include=*/") < args.index("--exclude=*")
+    output = """
+Number of files: 4 (reg: 3, dir: 1)
+Number of deleted files: 1
+Number of regular files transferred: 2
+Total file size: 1,048,576 bytes
+Literal data: 4,096 bytes
+Matched data: 524,288 bytes
+Total bytes sent: 5,000
+Total bytes received: 120
+"""
+    stats = workspace_sync._rsync_stats(output, 0)
+    assert stats["method"] == "rsync"
+    assert stats["files_scanned"] == 3 and stats["files_updated"] == 2 and stats["files_deleted"] == 1
+    assert stats["bytes_total"] == 1_048_576 and stats["bytes_synced"] == 528_384
+    assert stats["wire_bytes"] == 5_120
+
+class LocalSandbox:
+    """Route `docker exec [-i] sandbox CMD...` to CMD on this machine, with WORKSPACE in a temp dir.
+
+    Exercises the real transport: source as a `python3 -c` argument, JSON lines on stdin/stdout.
+    """
+
+    def __init__(self, tmp):
+        self.tmp = tmp
+        self.shim = os.path.join(tmp, "docker-shim")
+        with open(self.shim, "w") as f:
+            f.write('#!/bin/sh\nshift\n[ "$1" = "-i" ] && shift\nshift\nexec "$@"\n')
+        os.chmod(self.shim, os.stat(self.shim).st_mode | stat.S_IEXEC)
+        self.workspace = os.path.join(tmp, "workspace")
+        os.makedirs(self.workspace)
+
+    def __enter__(self):
+        self.saved_env = {
+            name: os.environ.get(name)
+            for name in (workspace_sync.SYNC_ROOT_ENV, workspace_sync.CACHE_DIR_ENV, workspace_sync.RSYNC_ENV)
+        }
+        os.environ[workspace_sync.SYNC_ROOT_ENV] = os.path.join(self.tmp, "host")
+        os.environ[workspace_sync.CACHE_DIR_ENV] = os.path.join(self.tmp, "cache")
+        os.environ[workspace_sync.RSYNC_ENV] = "0"
+        self.saved_workspace = workspace_sync.WORKSPACE
+        workspace_sync.WORKSPACE = self.workspace
+        placement.docker = lambda name="sandbox": self.shim
+        return self
+
+    def __exit__(self, *exc):
+        del placement.docker
+        workspace_sync.WORKSPACE = self.saved_workspace
+        for name, value in self.saved_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+async def test_sync_roundtrip():
+    with tempfile.TemporaryDirectory() as tmp, LocalSandbox(tmp) as sandbox:
+        data = os.urandom(300_000)
+        with open(os.path.join(sandbox.workspace, "data.bin"), "wb") as f:
+            f.write(data)
+
+        stats = await workspace_sync.sync_to_host("out")
+        assert stats["method"] == "delta"
+        assert stats["files_updated"] == 1 and stats["bytes_literal"] == len(data)
+        stats = await workspace_sync.sync_to_host("out")
+        assert stats["files_checked"] == 0
+
+        with open(os.path.join(sandbox.workspace, "data.bin"), "r+b") as f:
+            f.seek(1000)
+            f.write(b"changed")
+        stats = await workspace_sync.sync_to_host("out")
+        assert stats["files_updated"] == 1 and stats["bytes_literal"] < 20_000
+        host_out = os.path.join(tmp, "host", "out")
+        with open(os.path.join(host_out, "data.bin"), "rb") as f:
+            assert f.read()[1000:1007] == b"changed"
+
+        with open(os.path.join(host_out, "new.txt"), "w") as f:
+            f.write("from host")
+        with open(os.path.join(host_out, "data.bin"), "ab") as f:
+            f.write(b"appended")
+        stats = await workspace_sync.sync_from_host("out")
+        assert stats["files_updated"] == 2 and stats["bytes_matched"] >= 290_000
+        with open(os.path.join(sandbox.workspace, "data.bin"), "rb") as f:
+            assert f.read().endswith(b"appended")
+
+        os.unlink(os.path.join(host_out, "data.bin"))
+        stats = await workspace_sync.sync_from_host("out", delete=True)
+        assert stats["files_deleted"] == 1
+        assert os.listdir(sandbox.workspace) == ["new.txt"]
+
+    assert workspace_sync.WORKSPACE == "/workspace"
+    assert "docker" not in vars(placement)
+
+async def test_sync_metadata():
+    with tempfile.TemporaryDirectory() as tmp, LocalSandbox(tmp) as sandbox:
+        os.makedirs(os.path.join(sandbox.workspace, "empty", "nested"))
+        path = os.path.join(sandbox.workspace, "script.sh")
+        with open(path, "w") as f:
+            f.write("echo hi\n")
+        os.chmod(path, 0o750)
+        os.utime(path, ns=(1_600_000_000_000_000_000, 1_600_000_000_000_000_000))
+        os.symlink("script.sh", os.path.join(sandbox.workspace, "link"))
+
+        await workspace_sync.sync_to_host("out")
+        host_out = os.path.join(tmp, "host", "out")
+        # Like rsync -rtp: mtimes, modes and empty directories are kept, symlinks skipped
+        st = os.stat(os.path.join(host_out, "script.sh"))
+        assert st.st_mtime_ns == 1_600_000_000_000_000_000 and st.st_mode & 0o777 == 0o750
+        assert os.path.isdir(os.path.join(host_out, "empty", "nested"))
+        assert not os.path.lexists(os.path.join(host_out, "link"))
+
+        # Same content, new mtime: only the metadata is applied
+        os.utime(path, ns=(1_700_000_000_000_000_000, 1_700_000_000_000_000_000))
+        stats = await workspace_sync.sync_to_host("out")
+        assert stats["files_updated"] == 0 and stats["bytes_literal"] == 0
+        assert os.stat(os.path.join(host_out, "script.sh")).st_mtime_ns == 1_700_000_000_000_000_000
+
+        os.rmdir(os.path.join(host_out, "empty", "nested"))
+        os.makedirs(os.path.join(host_out, "from_host"))
+        os.utime(os.path.join(host_out, "from_host"), ns=(1_500_000_000_000_000_000,) * 2)
+        stats = await workspace_sync.sync_from_host("out", delete=True)
+        assert not os.path.exists(os.path.join(sandbox.workspace, "empty", "nested"))
+        created = os.path.join(sandbox.workspace, "from_host")
+        assert os.stat(created).st_mtime_ns == 1_500_000_000_000_000_000
+
+async def test_remote_error():
+    with tempfile.TemporaryDirectory() as tmp, LocalSandbox(tmp):
+        try:
+            async for _ in workspace_sync._remote({"op": "bogus"}, workspace_sync._Transfer()):
+                pass
+        except workspace_sync.SyncError as e:
+            assert "bogus" in str(e)
+        else:
+            raise AssertionError("Expected SyncError")
+
+def test_host_root_escape():
+    try:
+        workspace_sync.host_root("../../etc")
+    except workspace_sync.SyncError:
+        pass
+    else:
+        raise AssertionError("Expected SyncError")
+
+async def main():
+    test_delta_roundtrip()
+    test_literal_chunks()
+    test_manifest_filters()
+    test_rsync_args_and_stats()
+    await test_sync_roundtrip()
+    await test_sync_metadata()
+    await test_remote_error()
+    test_host_root_escape()
+    print("All tests passed")
+
+if __name__ == "__main__":
+    asyncio.run(main())
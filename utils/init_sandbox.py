@@ -1,35 +1,60 @@
 from command_exec import run_subprocess, CommandError
+from utils.placement import placement, PlacementError, SANDBOX_NAME, docker_cli
+from utils.workspace_state import sandbox_created
 
 
 async def ensure_sandbox_exists():
     """
-    Check if a container named sandbox already exists.
-    If not, create it with ports exposed.
+    Check if this instance's container (SANDBOX_NAME) already exists on one of
+    the docker hosts. If not, place it on the least-loaded host and create it
+    with ports published on free host ports, so several sandboxes can share a host.
+
+    Returns None when the sandbox is ready, or an error dict the tool should
+    return as is.
     """
 
     print("check if sandbox exists")
-    check_command = "docker ps -a --format '{{.Names}}' | grep -w sandbox"
+    try:
+        await placement.locate(SANDBOX_NAME)
+        return
+    except KeyError:
+        pass
+    except PlacementError as pe:
+        return {
+            "is_error": True,
+            "message": str(pe),
+        }
 
-    check_result = await run_subprocess(
-        check_command,
-        shell=True,
+    print("create sandbox")
+    try:
+        host = await placement.place(SANDBOX_NAME)
+    except PlacementError as pe:
+        return {
+            "is_error": True,
+            "message": str(pe),
+        }
+    command = (
+        f"{docker_cli(host)} run -d --name {SANDBOX_NAME} "
+        "-p 8080 -p 4040 "
+        "sandbox-image tail -f /dev/null"
     )
-
-    if check_result.code != 0:
-        print("create sandbox")
-        command = (
-            "docker run -d --name sandbox "
-            "-p 8080:8080 -p 4041:4040 "
-            "sandbox-image tail -f /dev/null"
+    try:
+        result = await run_subprocess(
+            command,
+            shell=True,
         )
-        try:
-            await run_subprocess(
-                command,
-                shell=True,
-            )
-        except CommandError as ce:
-            return {
-                "is_error": True,
-                "message": str(ce),
-                "command": command,
-            }
\ No newline at end of file
+    except CommandError as ce:
+        placement.forget(SANDBOX_NAME)
+        return {
+            "is_error": True,
+            "message": str(ce),
+            "command": command,
+        }
+    if result.code != 0:
+        placement.forget(SANDBOX_NAME)
+        return {
+            "is_error": True,
+            "message": result.stderr.strip() or "Failed to create sandbox",
+            "command": command,
+        }
+    sandbox_created()
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import re
+from dataclasses import dataclass
+from shlex import quote
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from command_exec import run_subprocess, CommandError
+from logging_utils import log_info, log_warn
+
+# Comma-separated DOCKER_HOST-style URLs, e.g.
+#   SANDBOX_DOCKER_HOSTS="unix:///var/run/docker.sock,tcp://10.0.0.2:2375,ssh://ops@node3"
+# When unset, everything targets the default daemon of the plain `docker` CLI.
+HOSTS_ENV = "SANDBOX_DOCKER_HOSTS"
+# Hosts listed here receive no new sandboxes (maintenance); existing ones keep working.
+DRAINED_ENV = "SANDBOX_DRAINED_HOSTS"
+# Optional file with one drained host URL per line, re-read before every
+# placement so hosts can be drained or restored without restarting the server.
+DRAIN_FILE_ENV = "SANDBOX_DRAIN_FILE"
+
+# Container count at which a host counts as "full" for scoring purposes.
+CONTAINERS_PER_HOST = int(os.getenv("SANDBOX_CONTAINERS_PER_HOST", "50"))
+
+# Name of the container owned by this server instance. Every instance sharing
+# the same docker hosts needs its own name, otherwise they share one sandbox.
+SANDBOX_NAME = os.getenv("SANDBOX_NAME", "sandbox")
+# Docker's own container-name rule; also keeps the name safe to splice into
+# shell commands unquoted.
+if not re.fullmatch(r"[a-zA-Z0-9][a-zA-Z0-9_.-]*", SANDBOX_NAME):
+    raise ValueError(f"Invalid SANDBOX_NAME: {SANDBOX_NAME!r}")
+
+
+class PlacementError(Exception):
+    """Raised when a sandbox cannot be placed, or its recorded host cannot be reached."""
+
+
+@dataclass
+class HostLoad:
+    url: Optional[str]
+    containers: int
+    cpu: float  # fraction of host CPUs in use by running containers (0..1+)
+    memory: float  # fraction of host memory in use by running containers (0..1)
+
+    @property
+    def score(self) -> float:
+        """Lower is better. Each component is roughly normalised to 0..1."""
+        return self.containers / CONTAINERS_PER_HOST + self.cpu + self.memory
+
+
+def docker_cli(url: Optional[str]) -> str:
+    """Return the docker CLI prefix targeting the given endpoint."""
+    if not url:
+        return "docker"
+    return f"docker -H {quote(url)}"
+
+
+def _percent(value: str) -> float:
+    try:
+        return float(value.strip().rstrip("%")) / 100
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+async def probe_host(url: Optional[str]) -> HostLoad:
+    """Query a docker endpoint for its running container count, CPU and memory usage."""
+    docker = docker_cli(url)
+    info_result = await run_subprocess(
+        f"{docker} info --format '{{{{json .}}}}'", shell=True, timeout=10
+    )
+    if info_result.code != 0:
+        raise CommandError(info_result.stderr.strip() or f"docker info failed on {url}")
+    info = json.loads(info_result.stdout)
+    ncpu = max(int(info.get("NCPU") or 1), 1)
+
+    stats_result = await run_subprocess(
+        f"{docker} stats --no-stream --format '{{{{json .}}}}'", shell=True, timeout=30
+    )
+    cpu = memory = 0.0
+    if stats_result.code == 0:
+        for line in stats_result.stdout.splitlines():
+            if not line.strip():
+                continue
+            stats = json.loads(line)
+            cpu += _percent(stats.get("CPUPerc", "0%"))
+            memory += _percent(stats.get("MemPerc", "0%"))
+
+    return HostLoad(
+        url=url,
+        containers=int(info.get("ContainersRunning") or 0),
+        cpu=cpu / ncpu,
+        memory=memory,
+    )
+
+
+async def find_container(url: Optional[str], name: str) -> bool:
+    """Return True if a container with this exact name exists on the endpoint.
+
+    Raises CommandError when the endpoint does not answer, which must not be
+    mistaken for the container being gone.
+    """
+    result = await run_subprocess(
+        f"{docker_cli(url)} ps -a --filter {quote(f'name=^/{name}$')} --format '{{{{.Names}}}}'",
+        shell=True,
+        timeout=10,
+    )
+    if result.code != 0:
+        raise CommandError(result.stderr.strip() or f"docker ps failed on {url}")
+    return name in result.stdout.split()
+
+
+class SandboxPlacement:
+    """Place sandboxes across several docker endpoints and remember where each one lives.
+
+    ``prober`` and ``locator`` default to the docker CLI helpers above and can
+    be swapped for fakes in tests.
+    """
+
+    def __init__(
+        self,
+        hosts: List[Optional[str]],
+        drained: Optional[List[str]] = None,
+        drain_file: Optional[str] = None,
+        prober: Callable[[Optional[str]], Awaitable[HostLoad]] = probe_host,
+        locator: Callable[[Optional[str], str], Awaitable[bool]] = find_container,
+    ):
+        self.hosts = hosts or [None]
+        self.drained = set(drained or [])
+        self.drain_file = drain_file
+        self.prober = prober
+        self.locator = locator
+        self.placements: Dict[str, Optional[str]] = {}
+
+    @classmethod
+    def from_env(cls) -> "SandboxPlacement":
+        def split(value: str) -> List[str]:
+            return [part.strip() for part in value.split(",") if part.strip()]
+
+        return cls(
+            hosts=split(os.getenv(HOSTS_ENV, "")),
+            drained=split(os.getenv(DRAINED_ENV, "")),
+            drain_file=os.getenv(DRAIN_FILE_ENV) or None,
+        )
+
+    def drained_hosts(self) -> set:
+        """Hosts that must not receive new sandboxes: the static list plus the drain file."""
+        drained = set(self.drained)
+        if self.drain_file:
+            try:
+                with open(self.drain_file, encoding="utf-8") as f:
+                    drained.update(line.strip() for line in f if line.strip())
+            except FileNotFoundError:
+                pass
+        return drained
+
+    async def locate(self, name: str) -> Optional[str]:
+        """Return the endpoint holding sandbox ``name``, or raise KeyError if it exists nowhere.
+
+        A remembered placement is re-checked so a container removed behind our
+        back is detected and can be recreated. If its host does not answer,
+        PlacementError is raised instead: the container may well be alive, and
+        recreating it elsewhere would silently swap in an empty workspace.
+        """
+        if name in self.placements:
+            url = self.placements[name]
+            try:
+                if await self.locator(url, name):
+                    return url
+            except CommandError as ce:
+                log_warn("docker endpoint unreachable", {"host": url, "error": str(ce)})
+                raise PlacementError(
+                    f"Docker host {url or 'default'} holding sandbox {name} is unreachable: {ce}"
+                ) from ce
+            self.forget(name)
+        found = await asyncio.gather(
+            *(self.locator(url, name) for url in self.hosts), return_exceptions=True
+        )
+        for url, result in zip(self.hosts, found):
+            if isinstance(result, CommandError):
+                log_warn("docker endpoint unreachable", {"host": url, "error": str(result)})
+            elif isinstance(result, BaseException):
+                raise result
+            elif result:
+                self.placements[name] = url
+                return url
+        raise KeyError(name)
+
+    async def place(self, name: str) -> Optional[str]:
+        """Pick the least-loaded, non-drained endpoint for a new sandbox and record it.
+
+        Endpoints are probed concurrently, so placement costs one probe, not one per host.
+        """
+        drained = self.drained_hosts()
+        candidates = [url for url in self.hosts if url not in drained]
+        probed = await asyncio.gather(
+            *(self.prober(url) for url in candidates), return_exceptions=True
+        )
+        loads = []
+        for url, result in zip(candidates, probed):
+            if isinstance(result, (CommandError, ValueError)):
+                log_warn("docker endpoint unreachable", {"host": url, "error": str(result)})
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                loads.append(result)
+        if not loads:
+            raise PlacementError("No available docker endpoint (all drained or unreachable)")
+        best = min(loads, key=lambda load: load.score)
+        log_info("placing sandbox", {"name": name, "host": best.url, "score": best.score})
+        self.placements[name] = best.url
+        return best.url
+
+    def forget(self, name: str):
+        self.placements.pop(name, None)
+
+    def docker(self, name: str = SANDBOX_NAME) -> str:
+        """Docker CLI prefix routing to the host recorded for sandbox ``name``."""
+        return docker_cli(self.placements.get(name, self.hosts[0]))
+
+
+placement = SandboxPlacement.from_env()
@@ -0,0 +1,460 @@
+"""rsync-style block signatures, deltas and patches.
+
+Standard library only: the same source runs on the MCP host and, passed to
+``python3 -c``, inside the sandbox container. There it reads one JSON request
+line from stdin (plus streamed op lines for ``patch``) and answers with one
+JSON message per line, ending with ``{"done": true}`` (see ``_remote_main``).
+"""
+
+import base64
+import contextlib
+import fnmatch
+import hashlib
+import json
+import math
+import mmap
+import os
+import sys
+import tempfile
+
+MIN_BLOCK = 2048
+MAX_BLOCK = 128 * 1024
+# Literal data is emitted in ops of at most this many bytes, so no single
+# message (and no buffer on either side) grows with the file size.
+LITERAL_CHUNK = 1 << 20
+# Unmatched bytes scanned one offset at a time before switching to testing
+# block-aligned offsets only, since per-byte rolling in pure Python is slow.
+ROLL_LIMIT = 256 * 1024
+# While stepping, roll one block length (which covers every alignment) after
+# this many blocks, so data that reappears at a shifted offset is still found.
+RESYNC_EVERY = 64
+COPY_CHUNK = 1 << 20
+
+
+def block_size(size: int) -> int:
+    """Block length for a file of ``size`` bytes (sqrt heuristic, like rsync)."""
+    return max(MIN_BLOCK, min(MAX_BLOCK, math.isqrt(size) // 8 * 8))
+
+
+# Weak checksum: polynomial (Rabin-Karp) hash base 256 modulo a 32-bit prime.
+# Unlike rsync's Adler-style sum it is computed for a whole block in C via
+# int.from_bytes, and it still rolls one byte at a time.
+WEAK_MOD = 4294967291
+
+
+def weak_checksum(block: bytes) -> int:
+    return int.from_bytes(block, "big") % WEAK_MOD
+
+
+def roll(weak: int, out: int, into: int, power: int) -> int:
+    """Slide the window one byte: drop ``out``, append ``into``. ``power`` is 256**(L-1) mod WEAK_MOD."""
+    return ((weak - out * power) * 256 + into) % WEAK_MOD
+
+
+def strong_checksum(block: bytes) -> str:
+    return hashlib.md5(block, usedforsecurity=False).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.md5(usedforsecurity=False)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def mapped(path: str):
+    """Read-only view of a file that is paged in on demand instead of loaded whole."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def signature(path: str) -> dict:
+    """Per-block weak/strong checksums of an existing file, plus its whole-file digest.
+
+    A missing file yields an empty signature, so the delta degrades to a full copy.
+    """
+    if not os.path.isfile(path):
+        return {"block": 0, "weak": [], "strong": [], "size": 0, "digest": None}
+    size = os.path.getsize(path)
+    length = block_size(size)
+    weak, strong = [], []
+    whole = hashlib.md5(usedforsecurity=False)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(length), b""):
+            weak.append(weak_checksum(block))
+            strong.append(strong_checksum(block))
+            whole.update(block)
+    return {
+        "block": length,
+        "weak": weak,
+        "strong": strong,
+        "size": size,
+        "digest": whole.hexdigest(),
+    }
+
+
+def iter_delta(data, sig: dict):
+    """Yield copy/literal operations encoding ``data`` against a signature.
+
+    Ops are ``["c", offset, length]`` (copy from the basis file) and
+    ``["l", base64]`` (at most LITERAL_CHUNK new bytes). ``data`` may be an
+    mmap. Matching blocks are skipped a whole block at a time; long unmatched
+    regions fall back to block-aligned probing (see ROLL_LIMIT).
+    """
+    length = sig["block"]
+    n = len(data)
+    pending_copy = None
+
+    def literal(start, end):
+        for offset in range(start, end, LITERAL_CHUNK):
+            chunk = data[offset : min(offset + LITERAL_CHUNK, end)]
+            yield ["l", base64.b64encode(chunk).decode("ascii")]
+
+    def flush_copy():
+        nonlocal pending_copy
+        if pending_copy:
+            yield pending_copy
+            pending_copy = None
+
+    if not length:
+        yield from literal(0, n)
+        return
+
+    # Full blocks roll; a short trailing block can only match at the very end.
+    full = sig["size"] // length
+    table = {}
+    for index in range(full):
+        table.setdefault(sig["weak"][index], []).append(index)
+    tail = sig["size"] - full * length
+    tail_strong = sig["strong"][full] if tail else None
+
+    power = pow(256, length - 1, WEAK_MOD)
+
+    def match(i):
+        candidates = table.get(weak)
+        if not candidates:
+            return None
+        strong = strong_checksum(data[i : i + length])
+        for index in candidates:
+            if sig["strong"][index] == strong:
+                return index
+        return None
+
+    i = lit_start = 0
+    roll_left, steps_left = ROLL_LIMIT, 0
+    if n >= length:
+        weak = weak_checksum(data[:length])
+    while i + length <= n:
+        index = match(i)
+        if index is not None:
+            if i > lit_start:
+                yield from flush_copy()
+                yield from literal(lit_start, i)
+            offset = index * length
+            if pending_copy and pending_copy[1] + pending_copy[2] == offset:
+                pending_copy[2] += length
+            else:
+                yield from flush_copy()
+                pending_copy = ["c", offset, length]
+            i += length
+            lit_start = i
+            roll_left, steps_left = ROLL_LIMIT, 0
+            if i + length <= n:
+                weak = weak_checksum(data[i : i + length])
+            continue
+
+        if roll_left > 0:
+            if i + length < n:
+                weak = roll(weak, data[i], data[i + length], power)
+            i += 1
+            roll_left -= 1
+            if not roll_left:
+                steps_left = RESYNC_EVERY
+        else:
+            i += length
+            if i + length <= n:
+                weak = weak_checksum(data[i : i + length])
+            steps_left -= 1
+            if not steps_left:
+                roll_left = length
+
+        # Stream long unmatched regions instead of holding them until the next match
+        if i - lit_start >= 2 * LITERAL_CHUNK:
+            yield from flush_copy()
+            yield from literal(lit_start, lit_start + LITERAL_CHUNK)
+            lit_start += LITERAL_CHUNK
+
+    if tail and n - lit_start >= tail and strong_checksum(data[n - tail :]) == tail_strong:
+        if n - tail > lit_start:
+            yield from flush_copy()
+            yield from literal(lit_start, n - tail)
+        offset = full * length
+        if pending_copy and pending_copy[1] + pending_copy[2] == offset:
+            pending_copy[2] += tail
+        else:
+            yield from flush_copy()
+            pending_copy = ["c", offset, tail]
+        yield from flush_copy()
+    else:
+        yield from flush_copy()
+        yield from literal(lit_start, n)
+
+
+def delta(data, sig: dict) -> list:
+    return list(iter_delta(data, sig))
+
+
+class Patcher:
+    """Rebuild a file from a basis and streamed delta ops, then atomically replace the target."""
+
+    def __init__(self, basis_path: str, target_path: str, mode=None):
+        directory = os.path.dirname(target_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        self.target_path = target_path
+        self.mode = mode
+        self.whole = hashlib.md5(usedforsecurity=False)
+        self.basis = open(basis_path, "rb") if os.path.isfile(basis_path) else None
+        fd, self.tmp = tempfile.mkstemp(dir=directory, prefix=".sync-")
+        self.out = os.fdopen(fd, "wb")
+
+    def apply(self, op: list):
+        if op[0] == "c":
+            self.basis.seek(op[1])
+            remaining = op[2]
+            while remaining:
+                chunk = self.basis.read(min(remaining, COPY_CHUNK))
+                if not chunk:
+                    raise ValueError(f"Basis too short for {self.target_path}")
+                self._write(chunk)
+                remaining -= len(chunk)
+        else:
+            self._write(base64.b64decode(op[1]))
+
+    def _write(self, chunk: bytes):
+        self.whole.update(chunk)
+        self.out.write(chunk)
+
+    def finish(self, digest: str, mtime_ns=None):
+        """Verify the rebuilt file against ``digest`` and move it into place."""
+        try:
+            self._close()
+            if self.whole.hexdigest() != digest:
+                raise ValueError(f"Checksum mismatch after patching {self.target_path}")
+            set_stat(self.tmp, self.mode, mtime_ns)
+            os.replace(self.tmp, self.target_path)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        self._close()
+        if os.path.exists(self.tmp):
+            os.unlink(self.tmp)
+
+    def _close(self):
+        self.out.close()
+        if self.basis:
+            self.basis.close()
+
+
+def patch(basis_path: str, ops, target_path: str, digest: str, mode=None):
+    """Apply a complete list of ops. Raises ValueError if the result does not match ``digest``."""
+    patcher = Patcher(basis_path, target_path, mode)
+    try:
+        for op in ops:
+            patcher.apply(op)
+    except BaseException:
+        patcher.abort()
+        raise
+    patcher.finish(digest)
+
+
+def _matches(rel: str, patterns) -> bool:
+    name = rel.rsplit("/", 1)[-1]
+    for pattern in patterns:
+        pattern = pattern.rstrip("/")
+        if fnmatch.fnmatch(rel, pattern) or fnmatch.fnmatch(name, pattern):
+            return True
+        if rel.startswith(pattern + "/"):
+            return True
+    return False
+
+
+def manifest(root: str, include=None, exclude=None) -> dict:
+    """Map relative path -> [size, mtime_ns, mode] for regular files under ``root``.
+
+    Directories are listed too, with a trailing "/" and size 0, so empty ones
+    are synced like with rsync. Symlinks are skipped (as rsync does without -l).
+    ``exclude`` patterns prune files and whole directories; when ``include``
+    is given, only files matching one of its patterns are listed and
+    directories only exist as parents of those files (rsync --prune-empty-dirs).
+    """
+    entries = {}
+    include = include or []
+    exclude = exclude or []
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        rel_dir = "" if rel_dir == "." else rel_dir + "/"
+        dirnames[:] = [
+            d
+            for d in dirnames
+            if not _matches(rel_dir + d, exclude) and not os.path.islink(os.path.join(dirpath, d))
+        ]
+        if rel_dir and not include:
+            entries[rel_dir] = [0, *stat_entry(dirpath)[1:]]
+        for filename in filenames:
+            rel = rel_dir + filename
+            if _matches(rel, exclude) or (include and not _matches(rel, include)):
+                continue
+            path = os.path.join(dirpath, filename)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            entries[rel] = stat_entry(path)
+    return entries
+
+
+def resolve(root: str, rel: str) -> str:
+    """Join a relative path onto ``root``, refusing anything that escapes it."""
+    path = os.path.normpath(os.path.join(root, rel))
+    if os.path.commonpath([os.path.abspath(root), os.path.abspath(path)]) != os.path.abspath(root):
+        raise ValueError(f"Path escapes sync root: {rel}")
+    return path
+
+
+def stat_entry(path: str) -> list:
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_mode & 0o7777]
+
+
+def is_dir_entry(rel: str) -> bool:
+    return rel.endswith("/")
+
+
+def set_stat(path: str, mode=None, mtime_ns=None):
+    """Apply a source file's permissions and modification time (rsync -p -t)."""
+    if mode is not None:
+        os.chmod(path, mode)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def sync_dirs(root: str, dirs: dict, deleted=()):
+    """Remove ``deleted`` directories and create ``dirs`` (rel -> entry) with their stats.
+
+    Both go deepest first: a directory is only removed once emptied (one still
+    holding excluded files is kept), and a parent's mtime is set after every
+    child that could bump it. Yields (rel, new entry) for each directory set.
+    """
+    for rel in sorted(deleted, reverse=True):
+        try:
+            os.rmdir(resolve(root, rel))
+        except OSError:
+            pass
+    for rel in sorted(dirs, reverse=True):
+        path = resolve(root, rel)
+        os.makedirs(path, exist_ok=True)
+        set_stat(path, dirs[rel][2], dirs[rel][1])
+        yield rel, [0, *stat_entry(path)[1:]]
+
+
+def delta_messages(rel: str, path: str, sig: dict):
+    """Messages describing how to turn the ``sig`` file into ``path``: same, or begin/ops/end.
+
+    Each carries the source mode and mtime, which the receiver applies.
+    """
+    digest = file_digest(path)
+    _, mtime_ns, mode = stat_entry(path)
+    if digest == sig["digest"]:
+        yield {"path": rel, "same": True, "mode": mode, "mtime": mtime_ns}
+        return
+    yield {"path": rel, "begin": True, "mode": mode}
+    with mapped(path) as data:
+        yield from iter_delta(data, sig)
+    yield {"path": rel, "end": True, "digest": digest, "mtime": mtime_ns}
+
+
+# Remote operations. Each gets the request header, the rest of stdin and an
+# ``emit`` callback writing one JSON message per line.
+
+
+def _op_manifest(request, stdin, emit):
+    for rel, entry in manifest(request["root"], request.get("include"), request.get("exclude")).items():
+        emit({"path": rel, "stat": entry})
+
+
+def _op_signatures(request, stdin, emit):
+    root = request["root"]
+    for rel in request["paths"]:
+        emit({"path": rel, "sig": signature(resolve(root, rel))})
+
+
+def _op_delta(request, stdin, emit):
+    root = request["root"]
+    for rel, sig in request["signatures"].items():
+        for message in delta_messages(rel, resolve(root, rel), sig):
+            emit(message)
+
+
+def _op_patch(request, stdin, emit):
+    root = request["root"]
+    deleted = request.get("delete", [])
+    for rel in deleted:
+        path = resolve(root, rel)
+        if not is_dir_entry(rel) and os.path.isfile(path):
+            os.unlink(path)
+    for rel, entry in sync_dirs(root, request.get("dirs", {}), filter(is_dir_entry, deleted)):
+        emit({"path": rel, "stat": entry})
+    patcher = None
+    try:
+        for line in stdin:
+            message = json.loads(line)
+            if isinstance(message, list):
+                patcher.apply(message)
+                continue
+            path = resolve(root, message["path"])
+            if message.get("begin"):
+                patcher = Patcher(path, path, message.get("mode"))
+                continue
+            if message.get("end"):
+                patcher.finish(message["digest"], message.get("mtime"))
+                patcher = None
+            elif message.get("same"):
+                set_stat(path, message.get("mode"), message.get("mtime"))
+            emit({"path": message["path"], "stat": stat_entry(path)})
+    finally:
+        if patcher:
+            patcher.abort()
+
+
+OPS = {
+    "manifest": _op_manifest,
+    "signatures": _op_signatures,
+    "delta": _op_delta,
+    "patch": _op_patch,
+}
+
+
+def _remote_main():
+    stdin = sys.stdin.buffer
+    out = sys.stdout
+
+    def emit(message):
+        out.write(json.dumps(message) + "\n")
+
+    try:
+        request = json.loads(stdin.readline())
+        OPS[request["op"]](request, stdin, emit)
+        emit({"done": True})
+    except Exception as e:
+        emit({"is_error": True, "message": f"{type(e).__name__}: {e}"})
+    out.flush()
+
+
+if __name__ == "__main__":
+    _remote_main()
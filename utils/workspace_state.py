@@ -0,0 +1,128 @@
+import uuid
+from shlex import quote
+
+from command_exec import run_subprocess, CommandError
+from utils.placement import placement, SANDBOX_NAME
+
+# Random per-process prefix so ETags issued before a server restart never
+# collide with the fresh counter that starts again at zero.
+_EPOCH = uuid.uuid4().hex[:8]
+_GENERATION = 0
+_FINGERPRINT = None
+# Set when something may have changed /workspace since the last fingerprint
+_DIRTY = True
+
+# Fingerprint of exactly what list_files shows (the non-recursive `ls -la`):
+# name, type, size, mtime, mode, owner, link count and symlink target of each
+# top-level entry. Deeper changes do not touch the listing, so they are not
+# walked. bash for pipefail, so a failing find is not mistaken for the hash of
+# empty input.
+FINGERPRINT_COMMAND = (
+    f"{{docker}} exec {SANDBOX_NAME} bash -o pipefail -c "
+    + quote(r"find /workspace -maxdepth 1 -printf '%p %y %s %T@ %m %u %g %n %l\n' | md5sum")
+)
+
+
+def workspace_generation() -> int:
+    return _GENERATION
+
+
+def workspace_etag() -> str:
+    """ETag describing the current workspace generation."""
+    return f'"{_EPOCH}-{_GENERATION}"'
+
+
+def _bump() -> int:
+    global _GENERATION
+    _GENERATION += 1
+    return _GENERATION
+
+
+def bump_generation() -> int:
+    """Record that the workspace changed. Called by every write tool."""
+    mark_dirty()
+    return _bump()
+
+
+def mark_dirty():
+    """Record that the workspace may have changed (e.g. after run_command).
+
+    Cheap on purpose: the fingerprint is only recomputed when a listing needs it.
+    """
+    global _DIRTY
+    _DIRTY = True
+
+
+def sandbox_created():
+    """A new, empty /workspace exists (possibly on another host): invalidate everything."""
+    global _FINGERPRINT
+    _FINGERPRINT = None
+    bump_generation()
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """Compare an If-None-Match value (single tag, list or "*") with an ETag."""
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def not_modified(etag: str, **extra) -> dict:
+    """Tiny response returned when the client's ETag is still current."""
+    return {"not_modified": True, "etag": etag, **extra}
+
+
+async def refresh_generation() -> bool:
+    """Fingerprint the /workspace listing and bump the generation if it moved.
+
+    When the fingerprint cannot be computed the generation is bumped anyway so
+    clients never keep a stale ETag.
+    """
+    global _FINGERPRINT, _DIRTY
+    _DIRTY = False
+    try:
+        result = await run_subprocess(
+            FINGERPRINT_COMMAND.format(docker=placement.docker()), shell=True
+        )
+    except CommandError:
+        result = None
+    if result is None or result.code != 0 or not result.stdout.strip():
+        _FINGERPRINT = None
+        _bump()
+        return True
+
+    fingerprint = result.stdout.split()[0]
+    changed = fingerprint != _FINGERPRINT
+    if changed:
+        _bump()
+    _FINGERPRINT = fingerprint
+    return changed
+
+
+async def listing_etag(if_none_match=None):
+    """Return (etag, matches) for a workspace listing.
+
+    Conditional requests always re-check the fingerprint, which also catches
+    writes from background processes the server never saw. Unconditional ones
+    only do so when the workspace is dirty, so the ETag they hand out is
+    anchored to a known fingerprint.
+    """
+    if if_none_match or _DIRTY or _FINGERPRINT is None:
+        await refresh_generation()
+    etag = workspace_etag()
+    return etag, etag_matches(if_none_match, etag)
+
+
+async def file_etag(container_path: str, max_bytes: int) -> str:
+    """Content-hash ETag of the first ``max_bytes`` of a file in the sandbox.
+
+    Only the bytes a read can actually serve are hashed, so large files are not
+    read in full. Raises CommandError if the file cannot be read.
+    """
+    script = f"head -c {max_bytes} {quote(container_path)} | sha256sum"
+    command = f"{placement.docker()} exec {SANDBOX_NAME} bash -o pipefail -c {quote(script)}"
+    result = await run_subprocess(command, shell=True)
+    if result.code != 0 or not result.stdout:
+        raise CommandError(result.stderr.strip() or "File does not exist")
+    return f'"sha256:{result.stdout.split()[0]}"'
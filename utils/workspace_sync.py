@@ -0,0 +1,412 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from contextlib import aclosing
+from dataclasses import dataclass
+from shlex import quote
+from typing import Iterator, List, Optional
+
+from command_exec import run_subprocess
+from utils import rsync_delta
+from utils.placement import placement, SANDBOX_NAME
+
+WORKSPACE = "/workspace"
+# Host directories given to the sync tools are resolved inside this root.
+SYNC_ROOT_ENV = "SANDBOX_SYNC_ROOT"
+# Per-directory manifests from the previous run live here.
+CACHE_DIR_ENV = "SANDBOX_SYNC_CACHE"
+# Set to 0 to use the built-in delta transfer even when rsync is available.
+RSYNC_ENV = "SANDBOX_SYNC_RSYNC"
+# Largest single message accepted from the sandbox. Literal ops carry at most
+# rsync_delta.LITERAL_CHUNK bytes (+1/3 for base64); signatures grow with sqrt(size).
+MAX_LINE_BYTES = 16 << 20
+# Changed files are handled in batches bounded by source size and file count,
+# so no request (e.g. the signatures it carries) grows with the whole tree.
+BATCH_BYTES = 64 << 20
+BATCH_FILES = 256
+
+with open(rsync_delta.__file__, encoding="utf-8") as _f:
+    _REMOTE_SOURCE = _f.read()
+
+_END = object()
+
+
+class SyncError(Exception):
+    """Raised when a sync cannot be started or a remote step fails."""
+
+
+@dataclass
+class _Transfer:
+    wire: int = 0
+    literal: int = 0
+    matched: int = 0
+    updated: int = 0
+
+    def count(self, op: list):
+        if op[0] == "c":
+            self.matched += op[2]
+        else:
+            self.literal += len(op[1]) * 3 // 4 - op[1][-2:].count("=")
+
+
+def host_root(host_dir: str) -> str:
+    root = os.path.abspath(os.getenv(SYNC_ROOT_ENV, "sync"))
+    try:
+        return rsync_delta.resolve(root, host_dir)
+    except ValueError as e:
+        raise SyncError(str(e))
+
+
+async def _send(stream: asyncio.StreamWriter, message, transfer: _Transfer):
+    data = (json.dumps(message) + "\n").encode("utf-8")
+    transfer.wire += len(data)
+    stream.write(data)
+    await stream.drain()
+
+
+async def _remote(request: dict, transfer: _Transfer, lines: Optional[Iterator] = None):
+    """Run one rsync_delta operation inside the sandbox and yield the messages it emits.
+
+    ``lines`` is streamed to the operation's stdin after the request. It is
+    advanced in a worker thread because producing deltas is CPU-bound. Output
+    is read one message at a time, each bounded by MAX_LINE_BYTES.
+    """
+    command = f"{placement.docker()} exec -i {SANDBOX_NAME} python3 -c {quote(_REMOTE_SOURCE)}"
+    proc = await asyncio.create_subprocess_shell(
+        command,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        limit=MAX_LINE_BYTES,
+    )
+
+    async def feed():
+        try:
+            await _send(proc.stdin, request, transfer)
+            while lines is not None:
+                message = await asyncio.to_thread(next, lines, _END)
+                if message is _END:
+                    break
+                await _send(proc.stdin, message, transfer)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the remote side stopped reading; its error is reported on stdout
+        finally:
+            proc.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    stderr = asyncio.create_task(proc.stderr.read())
+    done = False
+    try:
+        while True:
+            try:
+                line = await proc.stdout.readline()
+            except ValueError:
+                raise SyncError(f"Sandbox sent a message larger than {MAX_LINE_BYTES} bytes")
+            if not line:
+                break
+            transfer.wire += len(line)
+            message = json.loads(line)
+            if isinstance(message, dict):
+                if message.get("is_error"):
+                    raise SyncError(message["message"])
+                if message.get("done"):
+                    done = True
+                    continue
+            yield message
+        await feeder
+        code = await proc.wait()
+        if not done:
+            detail = (await stderr).decode("utf-8", errors="replace").strip()
+            raise SyncError(detail or f"Remote {request['op']} exited with {code} before finishing")
+    finally:
+        feeder.cancel()
+        stderr.cancel()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+def _cache_file(root: str, direction: str) -> str:
+    cache_dir = os.getenv(CACHE_DIR_ENV, os.path.expanduser("~/.cache/sandbox-sync"))
+    key = hashlib.sha256(f"{placement.docker()}|{root}|{direction}".encode()).hexdigest()
+    return os.path.join(cache_dir, f"{key[:32]}.json")
+
+
+def _load_cache(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path: str, src: dict, dst: dict):
+    """Remember source and destination stats of every file known to be in sync."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cache = {rel: [src[rel], dst[rel]] for rel in src if rel in dst}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+
+
+def _changed(src: dict, dst: dict, cache: dict) -> List[str]:
+    """Files whose source or destination moved since the cached run."""
+    return [
+        rel
+        for rel in src
+        if not rsync_delta.is_dir_entry(rel) and cache.get(rel) != [src[rel], dst.get(rel)]
+    ]
+
+
+def _dirs_to_sync(src: dict, dst: dict, paths: List[str]) -> dict:
+    """Source directories to create or re-stat once files are in place.
+
+    Those whose destination differs, plus every parent of a path being
+    written, deleted or created, since that bumps the parent's mtime.
+    """
+    dirs = {rel: entry for rel, entry in src.items() if rsync_delta.is_dir_entry(rel)}
+    stale = [rel for rel, entry in dirs.items() if dst.get(rel) != entry]
+    touched = set(stale)
+    for rel in [*paths, *stale]:
+        parts = rel.rstrip("/").split("/")[:-1]
+        touched.update("/".join(parts[: i + 1]) + "/" for i in range(len(parts)))
+    return {rel: entry for rel, entry in dirs.items() if rel in touched}
+
+
+def _batches(paths: List[str], sizes: dict):
+    batch, total = [], 0
+    for rel in paths:
+        if batch and (total + sizes[rel] > BATCH_BYTES or len(batch) >= BATCH_FILES):
+            yield batch
+            batch, total = [], 0
+        batch.append(rel)
+        total += sizes[rel]
+    if batch:
+        yield batch
+
+
+def _file_count(entries: dict) -> int:
+    return sum(not rsync_delta.is_dir_entry(rel) for rel in entries)
+
+
+def _stats(method: str, start: float, **counts) -> dict:
+    elapsed = time.monotonic() - start
+    synced = counts["bytes_literal"] + counts["bytes_matched"]
+    return {
+        "method": method,
+        **counts,
+        "bytes_synced": synced,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_bytes_per_s": int(synced / elapsed) if elapsed > 0 else None,
+    }
+
+
+async def _manifest_remote(include, exclude, transfer: _Transfer) -> dict:
+    request = {"op": "manifest", "root": WORKSPACE, "include": include, "exclude": exclude}
+    async with aclosing(_remote(request, transfer)) as messages:
+        return {message["path"]: message["stat"] async for message in messages}
+
+
+async def _delta_to_host(root: str, include, exclude, delete: bool, start: float) -> dict:
+    transfer = _Transfer()
+    src = await _manifest_remote(include, exclude, transfer)
+    dst = await asyncio.to_thread(rsync_delta.manifest, root, include, exclude)
+    cache_file = _cache_file(root, "to_host")
+    changed = _changed(src, dst, _load_cache(cache_file))
+    deleted = [rel for rel in dst if rel not in src] if delete else []
+    dirs = _dirs_to_sync(src, dst, changed + deleted)
+
+    for batch in _batches(changed, {rel: src[rel][0] for rel in changed}):
+        signatures = await asyncio.to_thread(
+            lambda: {rel: rsync_delta.signature(rsync_delta.resolve(root, rel)) for rel in batch}
+        )
+        request = {"op": "delta", "root": WORKSPACE, "signatures": signatures}
+        patcher = None
+        try:
+            async with aclosing(_remote(request, transfer)) as messages:
+                async for message in messages:
+                    if isinstance(message, list):
+                        transfer.count(message)
+                        await asyncio.to_thread(patcher.apply, message)
+                        continue
+                    rel = message["path"]
+                    path = rsync_delta.resolve(root, rel)
+                    if message.get("begin"):
+                        patcher = rsync_delta.Patcher(path, path, message["mode"])
+                        continue
+                    if message.get("end"):
+                        await asyncio.to_thread(patcher.finish, message["digest"], message.get("mtime"))
+                        patcher = None
+                        transfer.updated += 1
+                    elif message.get("same"):
+                        rsync_delta.set_stat(path, message.get("mode"), message.get("mtime"))
+                    dst[rel] = rsync_delta.stat_entry(path)
+        finally:
+            if patcher:
+                patcher.abort()
+
+    for rel in deleted:
+        path = rsync_delta.resolve(root, rel)
+        if not rsync_delta.is_dir_entry(rel) and os.path.isfile(path):
+            os.unlink(path)
+    deleted_dirs = filter(rsync_delta.is_dir_entry, deleted)
+    for rel, entry in rsync_delta.sync_dirs(root, dirs, deleted_dirs):
+        dst[rel] = entry
+
+    _save_cache(cache_file, src, dst)
+    return _stats(
+        "delta",
+        start,
+        files_scanned=_file_count(src),
+        files_checked=len(changed),
+        files_updated=transfer.updated,
+        files_deleted=len(deleted),
+        bytes_total=sum(entry[0] for entry in src.values()),
+        bytes_literal=transfer.literal,
+        bytes_matched=transfer.matched,
+        wire_bytes=transfer.wire,
+    )
+
+
+def _host_deltas(root: str, signatures: dict, transfer: _Transfer):
+    """Messages turning each sandbox file into its host counterpart (runs in a worker thread)."""
+    for rel, sig in signatures.items():
+        for message in rsync_delta.delta_messages(rel, rsync_delta.resolve(root, rel), sig):
+            if isinstance(message, list):
+                transfer.count(message)
+            elif message.get("end"):
+                transfer.updated += 1
+            yield message
+
+
+async def _delta_from_host(root: str, include, exclude, delete: bool, start: float) -> dict:
+    transfer = _Transfer()
+    src = await asyncio.to_thread(rsync_delta.manifest, root, include, exclude)
+    dst = await _manifest_remote(include, exclude, transfer)
+    cache_file = _cache_file(root, "from_host")
+    changed = _changed(src, dst, _load_cache(cache_file))
+    deleted = [rel for rel in dst if rel not in src] if delete else []
+    dirs = _dirs_to_sync(src, dst, changed + deleted)
+
+    for batch in _batches(changed, {rel: src[rel][0] for rel in changed}):
+        request = {"op": "signatures", "root": WORKSPACE, "paths": batch}
+        async with aclosing(_remote(request, transfer)) as replies:
+            signatures = {message["path"]: message["sig"] async for message in replies}
+        deltas = _host_deltas(root, signatures, transfer)
+        async with aclosing(_remote({"op": "patch", "root": WORKSPACE}, transfer, deltas)) as replies:
+            async for message in replies:
+                dst[message["path"]] = message["stat"]
+
+    if deleted or dirs:
+        request = {"op": "patch", "root": WORKSPACE, "delete": deleted, "dirs": dirs}
+        for rel in deleted:
+            dst.pop(rel, None)
+        async with aclosing(_remote(request, transfer)) as replies:
+            async for message in replies:
+                dst[message["path"]] = message["stat"]
+
+    _save_cache(cache_file, src, dst)
+    return _stats(
+        "delta",
+        start,
+        files_scanned=_file_count(src),
+        files_checked=len(changed),
+        files_updated=transfer.updated,
+        files_deleted=len(deleted),
+        bytes_total=sum(entry[0] for entry in src.values()),
+        bytes_literal=transfer.literal,
+        bytes_matched=transfer.matched,
+        wire_bytes=transfer.wire,
+    )
+
+
+async def _rsync_available() -> bool:
+    """Use real rsync when both the host and the sandbox have it, unless disabled."""
+    if os.getenv(RSYNC_ENV, "1").lower() in ("0", "false", "no", "off"):
+        return False
+    if not shutil.which("rsync"):
+        return False
+    result = await run_subprocess(
+        f"{placement.docker()} exec {SANDBOX_NAME} sh -c 'command -v rsync'", shell=True
+    )
+    return result.code == 0
+
+
+def _rsync_args(source: str, dest: str, include, exclude, delete: bool) -> List[str]:
+    # Uses `docker exec -i` as the remote shell: rsync runs `<shell> sandbox rsync --server ...`
+    args = ["rsync", "-rtp", "--stats", "--blocking-io", "-e", f"{placement.docker()} exec -i"]
+    if delete:
+        args.append("--delete")
+    args += [f"--exclude={pattern}" for pattern in exclude or []]
+    if include:
+        args.append("--include=*/")
+        for pattern in include:
+            args += [f"--include={pattern}", f"--include={pattern.rstrip('/')}/**"]
+        args += ["--exclude=*", "--prune-empty-dirs"]
+    return args + [source, dest]
+
+
+def _rsync_stats(output: str, start: float) -> dict:
+    def number(pattern: str) -> int:
+        found = re.search(pattern, output, re.MULTILINE)
+        return int(found.group(1).replace(",", "")) if found else 0
+
+    updated = number(r"^Number of regular files transferred: ([\d,]+)")
+    return _stats(
+        "rsync",
+        start,
+        files_scanned=number(r"reg: ([\d,]+)") or number(r"^Number of files: ([\d,]+)"),
+        files_checked=updated,
+        files_updated=updated,
+        files_deleted=number(r"^Number of deleted files: ([\d,]+)"),
+        bytes_total=number(r"^Total file size: ([\d,]+)"),
+        bytes_literal=number(r"^Literal data: ([\d,]+)"),
+        bytes_matched=number(r"^Matched data: ([\d,]+)"),
+        wire_bytes=number(r"^Total bytes sent: ([\d,]+)") + number(r"^Total bytes received: ([\d,]+)"),
+    )
+
+
+async def _rsync(source: str, dest: str, include, exclude, delete: bool, start: float) -> dict:
+    args = _rsync_args(source, dest, include, exclude, delete)
+    result = await run_subprocess(" ".join(quote(arg) for arg in args), shell=True)
+    if result.code != 0:
+        raise SyncError(result.stderr.strip() or f"rsync exited with {result.code}")
+    return _rsync_stats(result.stdout, start)
+
+
+async def sync_to_host(
+    host_dir: str,
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    delete: bool = False,
+) -> dict:
+    """Bring ``host_dir`` up to date with /workspace, transferring only changed blocks."""
+    start = time.monotonic()
+    root = host_root(host_dir)
+    os.makedirs(root, exist_ok=True)
+    if await _rsync_available():
+        stats = await _rsync(f"{SANDBOX_NAME}:{WORKSPACE}/", f"{root}/", include, exclude, delete, start)
+    else:
+        stats = await _delta_to_host(root, include, exclude, delete, start)
+    return {"host_dir": root, **stats}
+
+
+async def sync_from_host(
+    host_dir: str,
+    include: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    delete: bool = False,
+) -> dict:
+    """Bring /workspace up to date with ``host_dir``, transferring only changed blocks."""
+    start = time.monotonic()
+    root = host_root(host_dir)
+    if not os.path.isdir(root):
+        raise SyncError(f"Host directory does not exist: {root}")
+    if await _rsync_available():
+        stats = await _rsync(f"{root}/", f"{SANDBOX_NAME}:{WORKSPACE}/", include, exclude, delete, start)
+    else:
+        stats = await _delta_from_host(root, include, exclude, delete, start)
+    return {"host_dir": root, **stats}